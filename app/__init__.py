@@ -1,13 +1,22 @@
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 import os
 
+from .routes import bp as main_bp, warm_report_stack, warm_caches
+
+# Plantillas HTML compiladas a bytecode en disco: los workers (y los reinicios)
+# las cargan ya compiladas en vez de recompilarlas en el primer uso
+JINJA_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".jinja_cache")
+
 def create_app():
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY','dev')
-    from .routes import bp as main_bp
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
     app.register_blueprint(main_bp)
+    warm_caches()
+    # Con gunicorn --preload create_app corre en el master: precargar aquí la
+    # pila DOCX/pandas la comparte copy-on-write entre los workers
+    if os.environ.get("PRELOAD_REPORT_STACK", "0") == "1":
+        warm_report_stack()
     return app
-
-if __name__ == "__main__":
-    app = create_app()
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,170 @@
+"""
+GenoPilot – Conversión DOCX→PDF con Word vía COM (solo Windows)
+docx2pdf arranca y cierra Word en cada conversión (varios segundos). Aquí cada
+hilo del pool mantiene su propia instancia de Word viva entre conversiones; COM
+exige usar el objeto desde el hilo que lo creó, por eso una instancia por hilo.
+- Si Word no arranca (no instalado / COM sin registrar) se pasa a docx2pdf.
+- Si una conversión supera el timeout se mata ese proceso de Word: el hilo
+  queda libre y relanza Word para el siguiente trabajo.
+- Un error del propio documento no relanza Word: se propaga tal cual.
+"""
+from __future__ import annotations
+
+import atexit, os, signal, threading, uuid
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import pythoncom
+import win32com.client
+import win32gui
+import win32process
+
+try:
+    from docx2pdf import convert as _docx2pdf
+except ImportError:
+    _docx2pdf = None
+
+_WD_FORMAT_PDF  = 17   # wdFormatPDF
+_PDF_WORKERS    = max(1, int(os.getenv("PDF_WORKERS", "1")))
+_PDF_TIMEOUT_S  = 120
+# HRESULT de una instancia de Word caída (proceso muerto o matado por timeout)
+_WORD_GONE      = frozenset({
+    -2147417848,   # RPC_E_DISCONNECTED (0x80010108)
+    -2147023174,   # RPC_S_SERVER_UNAVAILABLE (0x800706BA)
+})
+
+_local = threading.local()
+_word_pids = set()       # PIDs de las instancias de Word vivas, para matarlas al salir
+_word_pids_lock = threading.Lock()
+_word_unavailable = False   # Word no arrancó: se usa docx2pdf en adelante
+
+
+class _WordUnavailable(RuntimeError):
+    """No se pudo crear la instancia de Word vía COM."""
+
+
+def _word_pid(word) -> int | None:
+    """PID del proceso WINWORD de la instancia (ventana localizada por título único)."""
+    word.Caption = f"GenoPilot-{uuid.uuid4().hex}"
+    hwnd = win32gui.FindWindow("OpusApp", word.Caption)
+    return win32process.GetWindowThreadProcessId(hwnd)[1] if hwnd else None
+
+
+def _start_word():
+    word = win32com.client.DispatchEx("Word.Application")
+    word.Visible = False
+    word.DisplayAlerts = 0
+    _local.word = word
+    try:
+        _local.pid = _word_pid(word)
+    except Exception:
+        _local.pid = None   # sin PID no se podrá matar ante un timeout ni al salir
+    if _local.pid:
+        with _word_pids_lock:
+            _word_pids.add(_local.pid)
+
+
+def _discard_word():
+    """Cierra la instancia de Word de este hilo; si no responde, mata su proceso."""
+    word, pid = _local.word, _local.pid
+    _local.word = _local.pid = None
+    with _word_pids_lock:
+        _word_pids.discard(pid)
+    try:
+        word.Quit()
+    except Exception:
+        if pid:
+            with suppress(OSError):
+                os.kill(pid, signal.SIGTERM)
+
+
+def _ensure_word():
+    """Arranca Word en este hilo la primera vez; si falla, marca Word como no disponible."""
+    global _word_unavailable
+    if getattr(_local, "word", None) is not None:
+        return
+    try:
+        pythoncom.CoInitialize()
+        _start_word()
+    except Exception as e:
+        _word_unavailable = True
+        raise _WordUnavailable(str(e)) from e
+
+
+def _save_as_pdf(word, in_path: str, out_path: str):
+    doc = word.Documents.Open(in_path, ReadOnly=True, AddToRecentFiles=False)
+    try:
+        doc.SaveAs(out_path, FileFormat=_WD_FORMAT_PDF)
+    finally:
+        doc.Close(0)     # wdDoNotSaveChanges
+
+
+def _convert_job(in_path: str, out_path: str, state: dict):
+    state["started"].set()
+    _ensure_word()
+    state["pid"] = _local.pid
+    try:
+        _save_as_pdf(_local.word, in_path, out_path)
+    except pythoncom.com_error as e:
+        # Error del documento (DOCX corrupto, salida bloqueada…) con Word sano:
+        # se propaga y la instancia sigue en uso
+        if not (state.get("killed") or e.hresult in _WORD_GONE):
+            raise
+        # Word caído o matado por timeout: se descarta y se relanza; solo se
+        # reintenta si no fue el timeout (el documento volvería a colgarlo)
+        _discard_word()
+        _start_word()
+        if state.get("killed"):
+            raise
+        state["pid"] = _local.pid
+        _save_as_pdf(_local.word, in_path, out_path)
+
+
+_executor = ThreadPoolExecutor(max_workers=_PDF_WORKERS, thread_name_prefix="word-pdf")
+
+
+def convert_docx_to_pdf(in_path: str, out_path: str):
+    """Misma firma que docx2pdf.convert(in, out); bloquea hasta terminar."""
+    in_path, out_path = os.path.abspath(in_path), os.path.abspath(out_path)
+    if _word_unavailable:
+        if _docx2pdf is None:
+            raise RuntimeError("Word no disponible vía COM y docx2pdf no instalado")
+        return _docx2pdf(in_path, out_path)
+
+    # El timeout cuenta desde que un hilo toma el trabajo, no desde que se
+    # encola: esperar detrás de otra conversión no debe matar un Word sano
+    state = {"started": threading.Event()}
+    job = _executor.submit(_convert_job, in_path, out_path, state)
+    job.add_done_callback(lambda _: state["started"].set())   # cancelado al cerrar
+    state["started"].wait()
+    try:
+        job.result(timeout=_PDF_TIMEOUT_S)
+    except _WordUnavailable:
+        if _docx2pdf is None:
+            raise
+        _docx2pdf(in_path, out_path)
+    except FutureTimeout:
+        # El hilo sigue bloqueado dentro de Word: matar el proceso lo libera
+        # (la llamada COM falla y el hilo relanza Word)
+        if state.get("pid"):
+            state["killed"] = True
+            try:
+                os.kill(state["pid"], signal.SIGTERM)
+            except OSError:
+                pass
+        raise
+
+
+@atexit.register
+def _kill_word():
+    """
+    Mata por PID las instancias de Word que sigan vivas. No se puede usar
+    word.Quit(): los proxies COM pertenecen a los hilos del pool (STA) y, al
+    correr atexit, esos hilos ya han terminado (RPC_E_WRONG_THREAD).
+    """
+    _executor.shutdown(wait=False, cancel_futures=True)
+    with _word_pids_lock:
+        for pid in _word_pids:
+            with suppress(OSError):
+                os.kill(pid, signal.SIGTERM)
+        _word_pids.clear()
@@ -2,49 +2,132 @@
 GenoPilot – Rutas Flask
 - '/'         : formulario
 - '/generate' : genera informe (intenta PDF vía DOCX→PDF; si no, entrega DOCX)
-Incluye fix de "tabla que desborda": tras renderizar el DOCX se fuerza el ancho
-de la tabla de resultados al ancho útil de página, con layout fijo y soft-wrap.
+Incluye fix de "tabla que desborda": la tabla de resultados se construye ya con
+el ancho útil de página de la plantilla, layout fijo y soft-wrap.
 """
 from __future__ import annotations
 
-from flask import Blueprint, render_template, request, send_file, session, redirect, url_for, flash
-import os, json, datetime, re, tempfile, unicodedata, uuid   
+import datetime
+import json
+import os
+import platform
+import re
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from functools import lru_cache, wraps
 from io import BytesIO
-import pandas as pd 
+from pathlib import Path
+from types import MappingProxyType
+from typing import TYPE_CHECKING
+from xml.sax.saxutils import escape
+
+from flask import Blueprint, render_template, request, send_file, session, redirect, url_for, flash, abort
+from jinja2 import Environment, Template
+from markupsafe import Markup
+from werkzeug.utils import secure_filename
+
+# orjson si está instalado (parseo 2-6x más rápido); si no, la stdlib
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+# docxtpl/python-docx y pandas se importan en el primer uso (generación de
+# informes / importación de lotes): un worker que solo sirve el formulario no
+# paga su carga ni su memoria. Con gunicorn --preload, warm_report_stack()
+# los carga antes del fork (ver create_app).
+if TYPE_CHECKING:
+    from docxtpl import DocxTemplate
 
-from docxtpl import DocxTemplate
-from docx import Document
-from docx.shared import Pt, Cm
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
-
-import os, platform
 DISABLE_PDF = os.getenv("DISABLE_PDF", "0") == "1"
 IS_WINDOWS = platform.system() == "Windows"
 
+# Conversión a PDF (Word vía COM) solo se importa si se va a usar; una vez por
+# proceso. Preferencia: sesión de Word persistente (pdf_worker); si falta
+# pywin32, docx2pdf (arranca Word en cada conversión).
+_convert = None
+if IS_WINDOWS and not DISABLE_PDF:
+    try:
+        from .pdf_worker import convert_docx_to_pdf as _convert
+    except ImportError:
+        try:
+            from docx2pdf import convert as _convert
+        except ImportError:
+            _convert = None
+
 bp = Blueprint("main", __name__)
 BASE_DIR     = os.path.dirname(os.path.dirname(__file__))
 DATA_DIR     = os.path.join(BASE_DIR, "data")
 REPORTS_DIR  = os.path.join(BASE_DIR, "reports")
 TPL_DATA_PATH = os.path.join(DATA_DIR, "GenoPilot_report_template.docx")
 TPL_APP_PATH  = os.path.join(os.path.dirname(__file__), "templates", "report_template.docx")
+TPL_PATH      = TPL_DATA_PATH if os.path.exists(TPL_DATA_PATH) else TPL_APP_PATH
 os.makedirs(REPORTS_DIR, exist_ok=True)
 
+# Plantilla DOCX leída una sola vez; cada petición parte de una copia en memoria
+_TPL_BYTES = Path(TPL_PATH).read_bytes() if os.path.exists(TPL_PATH) else None
+
 # app/routes.py  (coloca cerca de constantes ya definidas)
 ALLOWED_EXTS = {"xlsx", "xls", "csv"}  # === NEW ===
+_DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Patrones regex precompilados (limpieza de recomendaciones, alelos alternativos
+# y % de dosis)
+_RE_BRACKETS  = re.compile(r"\[.*?\]")
+_RE_URL       = re.compile(r"https?://\S+")
+_RE_ALT_SPLIT = re.compile(r"[\/,\s]+")
+_RE_PCT_RANGE = re.compile(r"(\d{1,3})\s*[–-]\s*(\d{1,3})\s*%")
+_RE_PCT       = re.compile(r"[≈~]?\s*(\d{1,3})\s*%")
 
 
 # ============================================================================
 # Carga de datos (desde tu Excel ya volcados a JSON)
 # ============================================================================
-with open(os.path.join(DATA_DIR, "markers.json"), "r", encoding="utf-8") as f:
-    MARKERS = json.load(f)
-with open(os.path.join(DATA_DIR, "cyp2d6_stars.json"), "r", encoding="utf-8") as f:
-    CYP_STARS = json.load(f)
-with open(os.path.join(DATA_DIR, "cyp2d6_pheno.json"), "r", encoding="utf-8") as f:
-    CYP_PHENO = json.load(f)
-with open(os.path.join(DATA_DIR, "recs.json"), "r", encoding="utf-8") as f:
-    RECS = json.load(f)
+# Solo lectura: se comparten entre peticiones/hilos (y, con gunicorn --preload,
+# se cargan una vez en el master antes del fork de los workers)
+MARKERS   = MappingProxyType(_json_loads(Path(DATA_DIR, "markers.json").read_bytes()))
+CYP_STARS = tuple(_json_loads(Path(DATA_DIR, "cyp2d6_stars.json").read_bytes()))
+CYP_PHENO = tuple(_json_loads(Path(DATA_DIR, "cyp2d6_pheno.json").read_bytes()))
+RECS      = tuple(_json_loads(Path(DATA_DIR, "recs.json").read_bytes()))
+
+# ============================================================================
+# Índice de recomendaciones por (gen, token de fenotipo)
+# ============================================================================
+# Token canónico para fenotipos en castellano (formulario) e inglés (recs.json/CPIC)
+_PHENO_TOKENS = {
+    "normal":       "normal",
+    "intermedio":   "intermedio",
+    "intermediate": "intermedio",
+    "lento":        "lento",
+    "pobre":        "pobre",
+    "poor":         "pobre",
+    "ultrarrápido": "ultrarrápido",
+    "ultrarapid":   "ultrarrápido",
+}
+
+def _phen_token(pheno: str) -> str | None:
+    """Devuelve el token canónico del fenotipo ('normal', 'intermedio', …) o None."""
+    for w in (pheno or "").lower().split():
+        tok = _PHENO_TOKENS.get(w)
+        if tok:
+            return tok
+    return None
+
+def _build_recs_index() -> dict[tuple[str, str], dict]:
+    """
+    Indexa RECS una sola vez por (gen, token); ante duplicados gana la primera fila.
+    """
+    index: dict[tuple[str, str], dict] = {}
+    for r in RECS:
+        tok = _phen_token(r.get("Phenotype", ""))
+        if tok:
+            index.setdefault((r["Gene"], tok), r)
+    return index
+
+_RECS_INDEX = _build_recs_index()
 
 # ============================================================================
 # Conjuntos de alelos * para selectores (DPYD / UGT1A1) derivados de MARKERS
@@ -69,34 +152,78 @@ def _collect_stars(gene: str, extra: list[str] | None = None) -> list[str]:
 DPYD_STARS   = _collect_stars("DPYD")
 UGT1A1_STARS = _collect_stars("UGT1A1", extra=["*28"])  # aseguramos *28 visible
 
+# Entradas por marcador (selectores del formulario); invariantes tras la carga
+_DPYD_INPUTS   = MappingProxyType({m["column"]: tuple(m["options"]) for m in MARKERS.get("DPYD", [])})
+_UGT_INPUTS    = MappingProxyType({m["column"]: tuple(m["options"]) for m in MARKERS.get("UGT1A1", [])})
+_CYP_INPUTS    = tuple((m["column"], tuple(m["options"])) for m in MARKERS.get("CYP2D6", []))
+_CYP_OPTIONS   = MappingProxyType(dict(_CYP_INPUTS))
+_UGT_FIRST_COL = next(iter(_UGT_INPUTS), None)
+
+# Columnas de marcador del Excel de laboratorio (orden CYP2D6, DPYD, UGT1A1)
+_LAB_MARKER_COLS = tuple(m["column"] for g in ("CYP2D6", "DPYD", "UGT1A1") for m in MARKERS.get(g, []))
+_LAB_COLS        = frozenset(("Sample/Assay",) + _LAB_MARKER_COLS)
+
 # ============================================================================
-# Helpers de recomendación corta / limpieza de texto
+# Tablas de decodificación por marcador (DPYD / CYP2D6), precalculadas
 # ============================================================================
-def rtext_short(gene: str, pheno: str, long_text: str) -> str:
-    """
-    Devuelve texto breve de recomendación para el informe.
-    Si no hay match en recs.json, aplica un fallback informativo y seguro.
-    """
-    SHORT_REC = {
-        ("DPYD", "metabolizador normal"):         "Dosis estándar según ficha técnica.",
-        ("DPYD", "metabolizador intermedio"):     "Reducir dosis inicial; titular y monitorizar.",
-        ("DPYD", "metabolizador lento"):          "Evitar fluoropirimidinas; valorar alternativas.",
-        ("UGT1A1", "metabolizador normal"):       "Dosis estándar según ficha técnica.",
-        ("UGT1A1", "metabolizador intermedio"):   "Considerar reducción dosis; monitorizar neutropenia.",
-        ("UGT1A1", "metabolizador lento"):        "Reducir dosis inicial (30–50%); monitorización estrecha.",
-        ("CYP2D6", "metabolizador normal"):       "Dosis estándar.",
-        ("CYP2D6", "metabolizador intermedio"):   "Considerar terapia hormonal alternativa.",
-        ("CYP2D6", "metabolizador pobre"):        "Evitar tamoxifeno; alternativa terapéutica.",
-        ("CYP2D6", "metabolizador ultrarrápido"): "Valorar alternativas según contexto.",
-    }
-    key = (gene, pheno.lower())
-    if key in SHORT_REC:
-        return SHORT_REC[key]
+def _build_marker_rules(gene: str, star_first_token: bool = False) -> list[tuple]:
+    """
+    Precalcula por marcador (column, label, events, star).
+    - label: prefijo 'column (rsid): ' de la línea de polimorfismos.
+    - events: {genotipo: nº de eventos} → 'ref/alt' y 'alt/ref' = 1; 'alt/alt' = 2.
+      Cualquier otro genotipo cuenta 0.
+    - star_first_token: usa el primer token de 'star' y descarta estrellas
+      vacías o '-' (criterio CYP2D6).
+    - Marcadores inactivos llevan events vacío: solo aportan la línea de
+      polimorfismos.
+    """
+    rules = []
+    for m in MARKERS.get(gene, []):
+        col, ref, var, star = m["column"], m["ref"], m["var"], m["star"]
+        active = True
+        if star_first_token:
+            star = (str(star).split(maxsplit=1) or [""])[0]
+            active = bool(star) and star != "-"
+        alt = _RE_ALT_SPLIT.split(var, maxsplit=1)[0] if var else ""
+        events = {}
+        if active and alt and alt != "-":
+            # hom primero: si ref == alt, la heterocigosis tiene prioridad
+            events = {f"{alt}/{alt}": 2, f"{ref}/{alt}": 1, f"{alt}/{ref}": 1}
+        rules.append((col, f"{col} ({m['rsid']}): ", events, star))
+    return rules
+
+_MARKER_EVENT_MAPS = {
+    "DPYD":   _build_marker_rules("DPYD"),
+    "CYP2D6": _build_marker_rules("CYP2D6", star_first_token=True),
+}
 
+# ============================================================================
+# Helpers de recomendación corta / limpieza de texto
+# ============================================================================
+# Recomendación breve por (gen, fenotipo en minúsculas)
+_SHORT_REC = {
+    ("DPYD", "metabolizador normal"):         "Dosis estándar según ficha técnica.",
+    ("DPYD", "metabolizador intermedio"):     "Reducir dosis inicial; titular y monitorizar.",
+    ("DPYD", "metabolizador lento"):          "Evitar fluoropirimidinas; valorar alternativas.",
+    ("UGT1A1", "metabolizador normal"):       "Dosis estándar según ficha técnica.",
+    ("UGT1A1", "metabolizador intermedio"):   "Considerar reducción dosis; monitorizar neutropenia.",
+    ("UGT1A1", "metabolizador lento"):        "Reducir dosis inicial (30–50%); monitorización estrecha.",
+    ("CYP2D6", "metabolizador normal"):       "Dosis estándar.",
+    ("CYP2D6", "metabolizador intermedio"):   "Considerar terapia hormonal alternativa.",
+    ("CYP2D6", "metabolizador pobre"):        "Evitar tamoxifeno; alternativa terapéutica.",
+    ("CYP2D6", "metabolizador ultrarrápido"): "Valorar alternativas según contexto.",
+}
+
+def rtext_short(long_text: str | None) -> str:
+    """
+    Limpia el texto largo de recs.json para el informe (sin referencias ni URLs).
+    Si no hay texto, aplica un fallback informativo y seguro. Los casos cubiertos
+    por _SHORT_REC se resuelven antes, en _rec_for.
+    """
     # Limpieza básica cuando hay texto largo en recs.json
-    t = re.sub(r"\[.*?\]", "", long_text or "")
-    t = re.sub(r"https?://\S+", "", t)
-    t = re.sub(r"\s+", " ", t).strip()
+    t = _RE_BRACKETS.sub("", long_text or "")
+    t = _RE_URL.sub("", t)
+    t = " ".join(t.split())   # colapsa espacios sin pasar por el motor regex
 
     # Fallback robusto (cuando no hay entrada en recs.json)
     if not t:
@@ -104,6 +231,45 @@ def rtext_short(gene: str, pheno: str, long_text: str) -> str:
                 "fenotipo/diplotipo. Seguir ficha técnica y monitorizar estrechamente.")
     return t
 
+@lru_cache(maxsize=256)
+def _rec_for(gene: str, pheno: str) -> str:
+    """
+    Recomendación breve para (gen, fenotipo): _SHORT_REC si lo cubre; si no,
+    fila de recs.json vía _RECS_INDEX + rtext_short. Dominio pequeño y finito
+    → memoizada.
+    """
+    val = _SHORT_REC.get((gene, pheno.lower()))
+    if val is not None:
+        return val
+    rec_row = _RECS_INDEX.get((gene, _phen_token(pheno)))
+    return rtext_short((rec_row or {}).get("RecText"))
+
+# ============================================================================
+# Memoización acotada a valores conocidos
+# ============================================================================
+def _memoize_if(known, maxsize: int):
+    """
+    lru_cache solo para las llamadas en que known(*args) es cierto. Los valores
+    llegan del formulario sin validar: cachear cualquier texto dejaría que un
+    cliente llenara la caché con entradas enormes. Fuera del dominio conocido se
+    calcula sin memoizar (mismo resultado).
+    """
+    def deco(fn):
+        cached = lru_cache(maxsize=maxsize)(fn)
+
+        @wraps(fn)
+        def wrapper(*args):
+            return cached(*args) if known(*args) else fn(*args)
+
+        wrapper.cache_info, wrapper.cache_clear = cached.cache_info, cached.cache_clear
+        return wrapper
+    return deco
+
+# Alelos de los selectores de diplotipo: únicos valores que se memoizan
+_DPYD_ALLELES = frozenset(DPYD_STARS)
+_UGT_ALLELES  = frozenset(UGT1A1_STARS)
+_CYP_ALLELES  = frozenset(CYP_STARS)
+
 # ============================================================================
 # Reglas de fenotipo – DPYD
 # ============================================================================
@@ -113,17 +279,10 @@ def dpyd_from_markers(values: dict):
     Regla docente: 1 variante no-*1 → intermedio; 2 variantes → lento.
     """
     stars_list, polym = [], []
-    for m in MARKERS.get("DPYD", []):
-        col, ref, var, star = m["column"], m["ref"], m["var"], m["star"]
+    for col, label, events, star in _MARKER_EVENT_MAPS["DPYD"]:
         geno = values.get(col, "-/-")
-        polym.append(f"{col} ({m['rsid']}): {geno}")
-
-        alt = re.split(r"[\/,\s]+", var)[0] if var else ""
-        if alt and alt != "-":
-            if geno in (f"{ref}/{alt}", f"{alt}/{ref}"):
-                stars_list.append(star)             # heterocigosis → 1 evento
-            elif geno == f"{alt}/{alt}":
-                stars_list.extend([star, star])     # homocigosis → 2 eventos
+        polym.append(label + geno)
+        stars_list.extend([star] * events.get(geno, 0))  # het → 1 evento; hom → 2
 
     if not stars_list:
         dipl, pheno = "*1/*1", "Metabolizador normal"
@@ -132,10 +291,10 @@ def dpyd_from_markers(values: dict):
     else:
         dipl, pheno = f"{stars_list[0]}/{stars_list[1]}", "Metabolizador lento"
 
-    rec_row = next((r for r in RECS if r["Gene"] == "DPYD" and r["Phenotype"].lower() in pheno.lower()), None)
-    return dipl, pheno, rtext_short("DPYD", pheno, (rec_row or {}).get("RecText")), polym
+    return dipl, pheno, _rec_for("DPYD", pheno), polym
 
 
+@_memoize_if(lambda a1, a2: a1 in _DPYD_ALLELES and a2 in _DPYD_ALLELES, maxsize=512)
 def dpyd_from_diplotype(a1: str, a2: str):
     """
     Determina DPYD directamente desde diplotipo (simple para docencia).
@@ -149,8 +308,7 @@ def dpyd_from_diplotype(a1: str, a2: str):
         pheno = "Metabolizador lento"
 
     dipl = f"{a1}/{a2}"
-    rec_row = next((r for r in RECS if r["Gene"] == "DPYD" and r["Phenotype"].lower() in pheno.lower()), None)
-    return dipl, pheno, rtext_short("DPYD", pheno, (rec_row or {}).get("RecText")), [f"DPYD diplotipo manual: {dipl}"]
+    return dipl, pheno, _rec_for("DPYD", pheno), (f"DPYD diplotipo manual: {dipl}",)
 
 # ============================================================================
 # Reglas de fenotipo – UGT1A1
@@ -169,10 +327,10 @@ def ugt1a1_from_markers(geno: str):
     else:
         dipl, pheno = "-/-", "Indeterminado"
 
-    rec_row = next((r for r in RECS if r["Gene"] == "UGT1A1" and r["Phenotype"].lower() in pheno.lower()), None)
-    return dipl, pheno, rtext_short("UGT1A1", pheno, (rec_row or {}).get("RecText")), polym
+    return dipl, pheno, _rec_for("UGT1A1", pheno), polym
 
 
+@_memoize_if(lambda a1, a2: a1 in _UGT_ALLELES and a2 in _UGT_ALLELES, maxsize=512)
 def ugt1a1_from_diplotype(a1: str, a2: str):
     """
     Determina fenotipo UGT1A1 a partir de diplotipo.
@@ -189,26 +347,29 @@ def ugt1a1_from_diplotype(a1: str, a2: str):
     else:
         pheno = "Metabolizador lento"
 
-    rec_row = next((r for r in RECS if r["Gene"] == "UGT1A1" and r["Phenotype"].lower() in pheno.lower()), None)
-    return pair, pheno, rtext_short("UGT1A1", pheno, (rec_row or {}).get("RecText")), [f"UGT1A1 diplotipo manual: {pair}"]
+    return pair, pheno, _rec_for("UGT1A1", pheno), (f"UGT1A1 diplotipo manual: {pair}",)
 
 # ============================================================================
 # Reglas de fenotipo – CYP2D6
 # ============================================================================
-def _cyp_lookup_pheno(dipl: str) -> str:
-    """
-    Busca fenotipo de CYP2D6 por diplotipo en la tabla docente; si no, heurística por AS.
-    """
-    row = next((r for r in CYP_PHENO if r["CYP2D6 Diplotype"] == dipl), None)
-    if row:
-        return row["Coded Diplotype/Phenotype Summary"]
-
-    # Heurística sencilla por Activity Score (docente)
+_CYP_PHENO_BY_DIPL: dict[str, str] = {
+    r["CYP2D6 Diplotype"]: r["Coded Diplotype/Phenotype Summary"] for r in CYP_PHENO
+}
+# Fenotipo CPIC (primera palabra) → texto del informe
+_CYP_PHENO_ES = {
+    "Normal":       "Metabolizador normal",
+    "Intermediate": "Metabolizador intermedio",
+    "Poor":         "Metabolizador pobre",
+    "Ultrarapid":   "Metabolizador ultrarrápido",
+}
+_LOSS_STARS    = frozenset({"*3", "*4", "*5", "*6", "*7", "*14", "*15", "*19", "*59"})
+_REDUCED_STARS = frozenset({"*10", "*17", "*29", "*41", "*56B"})
+
+def _cyp_heuristic(dipl: str) -> str:
+    """Heurística sencilla por Activity Score (docente)."""
     def ascore(star: str) -> float:
-        loss    = {"*3", "*4", "*5", "*6", "*7", "*14", "*15", "*19", "*59"}
-        reduced = {"*10", "*17", "*29", "*41", "*56B"}
-        if star in loss:    return 0.0
-        if star in reduced: return 0.5
+        if star in _LOSS_STARS:    return 0.0
+        if star in _REDUCED_STARS: return 0.5
         return 1.0
 
     a1, a2 = dipl.split("/")
@@ -218,28 +379,29 @@ def _cyp_lookup_pheno(dipl: str) -> str:
     if s <= 2.25:    return "Normal Metabolizer"
     return "Ultrarapid Metabolizer"
 
+# Estrellas con las que se construyen diplotipos: selectores y marcadores
+_CYP_LOOKUP_STARS = _CYP_ALLELES | {star for *_, star in _MARKER_EVENT_MAPS["CYP2D6"]}
+
+@_memoize_if(lambda dipl: all(s in _CYP_LOOKUP_STARS for s in dipl.split("/")), maxsize=256)
+def _cyp_lookup_pheno(dipl: str) -> str:
+    """
+    Busca fenotipo de CYP2D6 por diplotipo en la tabla docente; si no, heurística por AS.
+    """
+    pheno = _CYP_PHENO_BY_DIPL.get(dipl)
+    if pheno is not None:
+        return pheno
+    return _cyp_heuristic(dipl)
+
 
+@_memoize_if(lambda a1, a2: a1 in _CYP_ALLELES and a2 in _CYP_ALLELES, maxsize=512)
 def cyp2d6_from_stars(a1: str, a2: str):
     """
     Interpreta CYP2D6 desde diplotipo de estrellas.
     """
     dipl  = f"{a1}/{a2}"
     pheno = _cyp_lookup_pheno(dipl)
-    conv  = {
-        "Normal":      "Metabolizador normal",
-        "Intermediate":"Metabolizador intermedio",
-        "Poor":        "Metabolizador pobre",
-        "Ultrarapid":  "Metabolizador ultrarrápido",
-    }
-    for k, v in conv.items():
-        if pheno.startswith(k):
-            pheno = v
-    rec_row = next(
-        (r for r in RECS if r["Gene"] == "CYP2D6" and
-         ((pheno.split()[1] in r.get("Phenotype", "")) if " " in pheno else (pheno in r.get("Phenotype", "")))),
-        None
-    )
-    return dipl, pheno, rtext_short("CYP2D6", pheno, (rec_row or {}).get("RecText") or ""), [f"CYP2D6 diplotipo manual: {dipl}"]
+    pheno = _CYP_PHENO_ES.get(pheno.partition(" ")[0], pheno)
+    return dipl, pheno, _rec_for("CYP2D6", pheno), (f"CYP2D6 diplotipo manual: {dipl}",)
 
 
 def cyp2d6_from_markers(values: dict):
@@ -247,239 +409,287 @@ def cyp2d6_from_markers(values: dict):
     Construye diplotipo CYP2D6 a partir de marcadores individuales (aprox. docente).
     """
     hits, polym = [], []
-    for m in MARKERS.get("CYP2D6", []):
-        col, ref, var, star = m["column"], m["ref"], m["var"], str(m["star"]).split()[0]
+    for col, label, events, star in _MARKER_EVENT_MAPS["CYP2D6"]:
         geno = values.get(col, "-/-")
-        polym.append(f"{col} ({m['rsid']}): {geno}")
-        alt = re.split(r"[\/,\s]+", var)[0] if var else ""
-        if not star or star == "-":
-            continue
-        if alt and alt != "-":
-            if geno in (f"{ref}/{alt}", f"{alt}/{ref}"):
-                hits.append(star)
-            elif geno == f"{alt}/{alt}":
-                hits.extend([star, star])
+        polym.append(label + geno)
+        hits.extend([star] * events.get(geno, 0))
 
     dipl  = "*1/*1" if not hits else (f"*1/{hits[0]}" if len(hits) == 1 else f"{hits[0]}/{hits[1]}")
     pheno = _cyp_lookup_pheno(dipl)
-    conv  = {
-        "Normal":      "Metabolizador normal",
-        "Intermediate":"Metabolizador intermedio",
-        "Poor":        "Metabolizador pobre",
-        "Ultrarapid":  "Metabolizador ultrarrápido",
-    }
-    for k, v in conv.items():
-        if pheno.startswith(k):
-            pheno = v
-    rec_row = next(
-        (r for r in RECS if r["Gene"] == "CYP2D6" and
-         ((pheno.split()[1] in r.get("Phenotype", "")) if " " in pheno else (pheno in r.get("Phenotype", "")))),
-        None
-    )
-    return dipl, pheno, rtext_short("CYP2D6", pheno, (rec_row or {}).get("RecText") or ""), polym
+    pheno = _CYP_PHENO_ES.get(pheno.partition(" ")[0], pheno)
+    return dipl, pheno, _rec_for("CYP2D6", pheno), polym
+
+def warm_caches():
+    """
+    Resuelve el caso más habitual en modo diplotipo (*1/*1) para que la primera
+    petición ya lo encuentre en caché. Se llama desde create_app (con --preload,
+    en el master, y los workers lo heredan).
+    """
+    for from_dipl in (dpyd_from_diplotype, ugt1a1_from_diplotype, cyp2d6_from_stars):
+        from_dipl("*1", "*1")
 
 # ============================================================================
 # Construcción de tabla de resultados como subdocumento (preview y plantilla)
 # ============================================================================
-def _shade(cell, hex_fill: str):
-    """Aplica sombreado a una celda (hex RGB sin '#')."""
-    tcPr = cell._tc.get_or_add_tcPr()
-    shd = OxmlElement("w:shd")
-    shd.set(qn("w:val"), "clear")
-    shd.set(qn("w:color"), "auto")
-    shd.set(qn("w:fill"), hex_fill)
-    tcPr.append(shd)
-
-def _set_fixed_layout(table):
-    """Fuerza layout 'fixed' de tabla para que Word respete anchos de columna."""
-    tblPr = table._tbl.tblPr
-    layout = OxmlElement("w:tblLayout")
-    layout.set(qn("w:type"), "fixed")
-    tblPr.append(layout)
-
-def _set_col_widths(table, widths_cm):
-    """Aplica anchos por columna (cm) a todas las filas."""
-    _set_fixed_layout(table)
-    widths = [Cm(w) for w in widths_cm]
-    for row in table.rows:
-        for i, w in enumerate(widths):
-            row.cells[i].width = w
-
-def _set_font_size(cell, pt):
-    for p in cell.paragraphs:
-        for r in p.runs:
-            r.font.size = Pt(pt)
-
-# app/routes.py  (ajusta la tabla del informe para una 5ª columna 'Dosis (%)')  # === CHANGED ===
-def build_result_subdoc(tpl: DocxTemplate, summary: list):
+def _new_template() -> DocxTemplate:
+    """Devuelve una DocxTemplate nueva construida desde los bytes cacheados."""
+    from docxtpl import DocxTemplate
+    if _TPL_BYTES is None:
+        return DocxTemplate(TPL_PATH)  # sin plantilla en disco: error habitual de fichero
+    return DocxTemplate(BytesIO(_TPL_BYTES))
+
+class _CachedJinjaEnv(Environment):
+    """
+    Entorno Jinja compartido por todos los informes. docxtpl compila cada parte
+    XML con from_string(); como la plantilla no cambia, el fuente es idéntico en
+    cada petición y la compilación se reutiliza (una entrada por parte del DOCX).
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._compiled: dict[str, Template] = {}
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals is not None or template_class is not None or not isinstance(source, str):
+            return super().from_string(source, globals, template_class)
+        tpl = self._compiled.get(source)
+        if tpl is None:
+            tpl = self._compiled[source] = super().from_string(source)
+        return tpl
+
+_JINJA_ENV = _CachedJinjaEnv()
+
+# Cabeceras de la tabla de resultados y proporciones por columna
+# (Gen, Fenotipo, Fármaco, Dosis, Recomendación)
+_RESULT_HEADERS = ("Gen", "Fenotipo", "Fármaco de interés", "Dosis (%)", "Recomendación terapéutica")
+_FRACS          = (0.14, 0.22, 0.22, 0.12, 0.30)
+
+def _template_metrics() -> tuple[float, str | None]:
     """
-    Construye la tabla de resultados para incrustar en la plantilla (subdoc).
+    Devuelve (ancho útil de página en cm, styleId de 'Table Grid') de la plantilla.
+    El ancho lleva un 2% de margen de seguridad por redondeos. Sin plantilla en
+    disco se asume A4 con márgenes de 2,5 cm y el styleId por defecto de Word;
+    si la plantilla no define 'Table Grid', styleId None (bordes explícitos).
     """
-    sub = tpl.new_subdoc()
-    table = sub.add_table(rows=1, cols=5)  # 4 → 5
-    table.style = "Table Grid"
+    if _TPL_BYTES is None:
+        return 16.0 * 0.98, "TableGrid"
+    from docx import Document
+    doc = Document(BytesIO(_TPL_BYTES))
+    sec = doc.sections[0]
+    usable_cm = (sec.page_width.cm - sec.left_margin.cm - sec.right_margin.cm) * 0.98
+    try:
+        style_id = doc.styles["Table Grid"].style_id
+    except KeyError:
+        style_id = None
+    return usable_cm, style_id
+
+def _col_widths_cm(usable_cm: float, fracs: tuple) -> list[float]:
+    """Anchos por columna (cm) proporcionales al ancho útil, sin superarlo."""
+    widths = [round(usable_cm * f, 2) for f in fracs]
+    overflow = sum(widths) - usable_cm
+    if overflow > 0:
+        widths[-1] = round(widths[-1] - overflow, 2)
+    return widths
 
-    headers = ["Gen", "Fenotipo", "Fármaco de interés", "Dosis (%)", "Recomendación terapéutica"]  # nuevo orden
-    hdr = table.rows[0].cells
-    for i, t in enumerate(headers):
-        hdr[i].text = t
-        _shade(hdr[i], "DDDDDD")
-        _set_font_size(hdr[i], 10)
+_SOFT_BREAK_TABLE = str.maketrans({c: c + "\u200b" for c in "/-_.,;:"})
+
+def _soft_breaks(s: str) -> str:
+    """
+    Inserta 'zero-width space' tras separadores comunes para permitir el corte
+    de líneas largas (URLs, DOIs, fármacos compuestos, etc.).
+    """
+    return s.translate(_SOFT_BREAK_TABLE) if s else s
+
+# ----------------------------------------------------------------------------
+# OOXML de la tabla: layout fijo, anchos finales, cabecera sombreada y 10 pt.
+# Cabecera y rejilla son invariantes: se generan una vez, en la primera tabla.
+# ----------------------------------------------------------------------------
+_SHD_HEADER = '<w:shd w:val="clear" w:color="auto" w:fill="DDDDDD"/>'
+# Rejilla equivalente a 'Table Grid' para plantillas que no definen ese estilo
+_GRID_BORDERS = '<w:tblBorders>' + "".join(
+    f'<w:{side} w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    for side in ("top", "left", "bottom", "right", "insideH", "insideV")
+) + '</w:tblBorders>'
+
+def _tc_xml(width_tw: int, text: str, shd: str = "") -> str:
+    """Celda w:tc con ancho fijo (dxa), sombreado opcional y texto a 10 pt."""
+    body = '</w:t><w:br/><w:t xml:space="preserve">'.join(escape(line) for line in str(text).split("\n"))
+    return (f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width_tw}"/>{shd}</w:tcPr>'
+            f'<w:p><w:r><w:rPr><w:sz w:val="20"/></w:rPr>'
+            f'<w:t xml:space="preserve">{body}</w:t></w:r></w:p></w:tc>')
+
+def _tr_xml(widths_tw, cells, shd: str = "") -> str:
+    return "<w:tr>" + "".join(_tc_xml(w, t, shd) for w, t in zip(widths_tw, cells)) + "</w:tr>"
+
+@lru_cache(maxsize=None)
+def _result_table_layout() -> tuple[tuple[int, ...], str]:
+    """
+    Devuelve (anchos de columna en twips, OOXML de apertura de la tabla: tblPr,
+    rejilla y fila de cabecera), calculados a partir de la plantilla.
+    """
+    from docx.shared import Cm
+    usable_cm, style_id = _template_metrics()
+    widths_tw = tuple(Cm(w).twips for w in _col_widths_cm(usable_cm, _FRACS))
+    head_xml = (
+        '<w:tbl>'   # prefijo w: ya declarado en el documento de la plantilla
+        '<w:tblPr>'
+        + (f'<w:tblStyle w:val="{escape(style_id)}"/>' if style_id else "")
+        + '<w:tblW w:type="auto" w:w="0"/>'
+        + ("" if style_id else _GRID_BORDERS)
+        + '<w:tblLayout w:type="fixed"/>'
+        '<w:tblLook w:val="04A0" w:firstRow="1" w:lastRow="0" w:firstColumn="1"'
+        ' w:lastColumn="0" w:noHBand="0" w:noVBand="1"/></w:tblPr>'
+        '<w:tblGrid>' + "".join(f'<w:gridCol w:w="{w}"/>' for w in widths_tw) + '</w:tblGrid>'
+        + _tr_xml(widths_tw, _RESULT_HEADERS, _SHD_HEADER)
+    )
+    return widths_tw, head_xml
 
-    for row in summary:
-        r = table.add_row().cells
-        r[0].text = row["gen"]
-        r[1].text = row["pheno"]
-        r[2].text = row["drug"]
-        r[3].text = row.get("dose", "—")  # NUEVO
-        r[4].text = row["rec"]
-        for c in r:
-            _set_font_size(c, 10)
+# app/routes.py  (ajusta la tabla del informe para una 5ª columna 'Dosis (%)')  # === CHANGED ===
+def build_result_subdoc(summary: list) -> Markup:
+    """
+    Construye la tabla de resultados para incrustar en la plantilla.
+    Se emite como un único fragmento OOXML (w:tbl) ya ajustado al ancho útil de
+    página y con soft-wrap en fármaco y recomendación: no hace falta retocar el DOCX.
+    Es el mismo XML que docxtpl serializaría desde un Subdoc, pero sin crear
+    (tpl.new_subdoc) ni parsear un Document por petición.
+    """
+    widths_tw, head_xml = _result_table_layout()
+    body_rows = "".join(
+        _tr_xml(widths_tw, (row["gen"], row["pheno"], _soft_breaks(row["drug"]),
+                 row.get("dose", "—"), _soft_breaks(row["rec"])))
+        for row in summary
+    )
+    return Markup(head_xml + body_rows + "</w:tbl>")
 
-    return sub
+def warm_report_stack():
+    """
+    Importa docxtpl/python-docx y pandas y calcula el layout de la tabla por
+    adelantado. Pensado para gunicorn --preload: se ejecuta en el master y los
+    workers lo heredan tras el fork en lugar de cargarlo cada uno por su cuenta.
+    """
+    import docxtpl, pandas   # noqa: F401  (solo precarga)
+    _result_table_layout()
 
 # ============================================================================
-# Ajuste post-render: evita "tabla que desborda" en el DOCX final
+# Formulario → análisis (compartido por '/' y '/generate')
 # ============================================================================
-def _norm(s: str) -> str:
-    """Normaliza texto (minúsculas + sin acentos) para comparaciones robustas."""
-    s = unicodedata.normalize("NFKD", s)
-    s = "".join(c for c in s if not unicodedata.combining(c))
-    return s.lower().strip()
+_MODES = frozenset(("markers", "diplotype"))
+
+def _known_selection(vals: tuple, options, mode: str, a1: str, a2: str, alleles) -> bool:
+    """Selección de un gen hecha solo con opciones de los selectores del formulario."""
+    if mode not in _MODES:
+        return False
+    if mode == "diplotype":
+        return a1 in alleles and a2 in alleles
+    return all(geno in options.get(col, ()) for col, geno in vals)
+
+def _known_state(state_key: tuple) -> bool:
+    """True si toda la selección de _analyze_genes sale de las opciones conocidas."""
+    (dpyd_mode, dpyd_vals, dpyd_a1, dpyd_a2,
+     ugt_mode, ugt_geno, ugt_a1, ugt_a2,
+     cyp_mode, cyp_vals, cyp_a1, cyp_a2) = state_key
+    ugt_vals = ((_UGT_FIRST_COL, ugt_geno),) if ugt_mode == "markers" else ()
+    return (_known_selection(dpyd_vals, _DPYD_INPUTS, dpyd_mode, dpyd_a1, dpyd_a2, _DPYD_ALLELES)
+            and _known_selection(ugt_vals, _UGT_INPUTS, ugt_mode, ugt_a1, ugt_a2, _UGT_ALLELES)
+            and _known_selection(cyp_vals, _CYP_OPTIONS, cyp_mode, cyp_a1, cyp_a2, _CYP_ALLELES))
+
+@_memoize_if(_known_state, maxsize=1024)
+def _analyze_genes(state_key: tuple) -> tuple[tuple, tuple, tuple]:
+    """
+    Análisis de los tres genes para una selección del formulario (ver
+    _analyze_form). Los datos de referencia son estáticos, así que el resultado
+    solo depende de la selección: el preview ('/') y el '/generate' que le sigue
+    comparten cálculo. Solo se memoiza si la selección sale de los selectores
+    (_known_state).
+    Devuelve ((dipl, pheno, rec, poly) de DPYD, de CYP2D6, de UGT1A1).
+    """
+    (dpyd_mode, dpyd_vals, dpyd_a1, dpyd_a2,
+     ugt_mode, ugt_geno, ugt_a1, ugt_a2,
+     cyp_mode, cyp_vals, cyp_a1, cyp_a2) = state_key
+    if dpyd_mode == "diplotype":
+        dpyd = dpyd_from_diplotype(dpyd_a1, dpyd_a2)
+    else:
+        dpyd = dpyd_from_markers(dict(dpyd_vals))
+    if ugt_mode == "diplotype":
+        ugt = ugt1a1_from_diplotype(ugt_a1, ugt_a2)
+    else:
+        ugt = ugt1a1_from_markers(ugt_geno)
+    if cyp_mode == "markers":
+        cyp = cyp2d6_from_markers(dict(cyp_vals))
+    else:
+        cyp = cyp2d6_from_stars(cyp_a1, cyp_a2)
+    # poly como tupla: el resultado cacheado se comparte entre peticiones
+    return tuple((dipl, pheno, rec, tuple(poly)) for dipl, pheno, rec, poly in (dpyd, cyp, ugt))
 
-def _soft_breaks(s: str) -> str:
+def _analyze_form(form) -> dict:
     """
-    Inserta 'zero-width space' tras separadores comunes para permitir el corte
-    de líneas largas (URLs, DOIs, fármacos compuestos, etc.).
+    Lee paciente, datos clínicos y la selección de cada gen (marcadores o
+    diplotipo) del formulario y ejecuta los análisis. Compartido por el preview
+    ('/') y '/generate'.
+    Devuelve {"patient", "clinical", "state" (valores del formulario para
+    re-pintarlo), "DPYD"/"CYP2D6"/"UGT1A1": (dipl, pheno, rec, poly)}.
     """
-    if not s:
-        return s
-    breakers = "/-_.,;:"
-    out = []
-    for ch in s:
-        out.append(ch)
-        if ch in breakers:
-            out.append("\u200b")
-    return "".join(out)
-
-def fit_results_table(doc) -> None:
-    """
-    Localiza la tabla de RESULTADO y la ajusta al ANCHO ÚTIL DE PÁGINA.
-    - Fuerza layout fijo.
-    - Asigna anchos proporcionales: 16% | 22% | 22% | 40%.
-    - Aplica soft-wrap en columnas 3 y 4 (fármaco, recomendación).
-    """
-    # 1) Localizar tabla por cabecera
-    def is_results_table(table) -> bool:
-        try:
-            hdr = [_norm(c.text) for c in table.rows[0].cells]
-            # 5 columnas (nuevo)
-            ok5 = (len(hdr) == 5 and
-                "gen" in hdr[0] and "fenotipo" in hdr[1] and
-                ("farmaco" in hdr[2] or "fármaco" in hdr[2]) and
-                "dosis" in hdr[3] and "recomendacion" in hdr[4])
-            # 4 columnas (compatibilidad atrás)
-            ok4 = (len(hdr) == 4 and
-                "gen" in hdr[0] and "fenotipo" in hdr[1] and
-                ("farmaco" in hdr[2] or "fármaco" in hdr[2]) and
-                "recomendacion" in hdr[3])
-            return ok4 or ok5
-        except Exception:
-            return False
+    fg = form.get
+    # --------------------------- Datos paciente ---------------------------
+    patient = {
+        "nombre":     fg("nombre", ""),
+        "apellidos":  fg("apellidos", ""),
+        "full_name":  (fg("nombre", "") + " " + fg("apellidos", "")).strip(),
+        "historia":   fg("historia", ""),
+        "sexo":       fg("sexo", "-"),
+        "fecha_nac":  fg("fecha_nac", "")
+    }
+    clinical = {
+        "enf_actual":  fg("enf_actual", ""),
+        "otras_pat":   fg("otras_pat", ""),
+        "tratamiento": fg("tto", ""),
+    }
 
-    table = next((t for t in doc.tables if is_results_table(t)), None)
-    if not table:
-        return  # nada que ajustar
+    # ---------------- Selección por gen (solo los campos del modo) ----------------
+    dpyd_mode = fg("dpyd_mode", "markers")
+    if dpyd_mode == "diplotype":
+        dpyd_vals, dpyd_a1, dpyd_a2 = {}, fg("dpyd_a1", "*1"), fg("dpyd_a2", "*1")
+    else:
+        dpyd_vals, dpyd_a1, dpyd_a2 = {k: fg(k, "-/-") for k in _DPYD_INPUTS}, "", ""
 
-    # 2) Ancho útil de página en cm
-    sec = doc.sections[0]
-    usable_cm = sec.page_width.cm - sec.left_margin.cm - sec.right_margin.cm
-    # Margen de seguridad por redondeos
-    usable_cm *= 0.98
-
-    # 3) Proporciones de columnas (ajustables si lo deseas)
-    cols = len(table.columns)
-    if cols == 5:
-        fracs = (0.14, 0.22, 0.22, 0.12, 0.30)  # Gen, Fenotipo, Fármaco, Dosis, Recomendación
+    ugt_mode = fg("ugt_mode", "markers")
+    if ugt_mode == "diplotype":
+        ugt_geno, ugt_a1, ugt_a2 = "-/-", fg("ugt_a1", "*1"), fg("ugt_a2", "*1")
     else:
-        fracs = (0.16, 0.22, 0.22, 0.40)
-    widths_cm = [round(usable_cm * f, 2) for f in fracs]
-    # Asegurar que la suma no supera el usable
-    overflow = sum(widths_cm) - usable_cm
-    if overflow > 0:
-        widths_cm[-1] = round(widths_cm[-1] - overflow, 2)
+        ugt_geno, ugt_a1, ugt_a2 = fg(_UGT_FIRST_COL, "-/-"), "", ""
 
-    # 4) Aplicar layout y anchos
-    _set_col_widths(table, widths_cm)
+    cyp_mode = fg("cyp_mode", "diplotype")
+    if cyp_mode == "markers":
+        cyp_vals, cyp_a1, cyp_a2 = {m[0]: fg(m[0], "-/-") for m in _CYP_INPUTS}, "", ""
+    else:
+        cyp_vals, cyp_a1, cyp_a2 = {}, fg("cyp_a1", "*1"), fg("cyp_a2", "*1")
+
+    dpyd, cyp, ugt = _analyze_genes((
+        dpyd_mode, tuple(dpyd_vals.items()), dpyd_a1, dpyd_a2,
+        ugt_mode,  ugt_geno,                 ugt_a1,  ugt_a2,
+        cyp_mode,  tuple(cyp_vals.items()),  cyp_a1,  cyp_a2,
+    ))
 
-    # 5) Soft-wrap para textos “duros” (URLs/DOIs) en fármaco y recomendación
-    for r in table.rows[1:]:
-        for idx in (2, 3):
-            for p in r.cells[idx].paragraphs:
-                p.text = _soft_breaks(p.text)
+    return {
+        "patient": patient,
+        "clinical": clinical,
+        "state": {
+            "dpyd_mode": dpyd_mode, "dpyd_vals": dpyd_vals, "dpyd_a1": dpyd_a1, "dpyd_a2": dpyd_a2,
+            "ugt_mode":  ugt_mode,  "ugt_geno":  ugt_geno,  "ugt_a1":  ugt_a1,  "ugt_a2":  ugt_a2,
+            "cyp_mode":  cyp_mode,  "cyp_vals":  cyp_vals,  "cyp_a1":  cyp_a1,  "cyp_a2":  cyp_a2,
+        },
+        "DPYD": dpyd, "CYP2D6": cyp, "UGT1A1": ugt,
+    }
 
 # ============================================================================
 # Rutas
 # ============================================================================
 @bp.route("/", methods=["GET", "POST"])
 def index():
-    # Inputs por marcador (para selectores)
-    dpyd_inputs = {m["column"]: m["options"] for m in MARKERS.get("DPYD", [])}
-    ugt_inputs  = {m["column"]: m["options"] for m in MARKERS.get("UGT1A1", [])}
-    cyp_inputs  = [(m["column"], m["options"]) for m in MARKERS.get("CYP2D6", [])]
-
     if request.method == "POST":
-        # --------------------------- Datos paciente ---------------------------
-        patient = {
-            "nombre":     request.form.get("nombre", ""),
-            "apellidos":  request.form.get("apellidos", ""),
-            "full_name":  (request.form.get("nombre", "") + " " + request.form.get("apellidos", "")).strip(),
-            "historia":   request.form.get("historia", ""),
-            "sexo":       request.form.get("sexo", "-"),
-            "fecha_nac":  request.form.get("fecha_nac", "")
-        }
-        clinical = {
-            "enf_actual":  request.form.get("enf_actual", ""),
-            "otras_pat":   request.form.get("otras_pat", ""),
-            "tratamiento": request.form.get("tto", ""),
-        }
-
-        # ------------------------------ DPYD ---------------------------------
-        dpyd_mode = request.form.get("dpyd_mode", "markers")
-        if dpyd_mode == "diplotype":
-            dpyd_a1 = request.form.get("dpyd_a1", "*1")
-            dpyd_a2 = request.form.get("dpyd_a2", "*1")
-            dpyd_dipl, dpyd_pheno, dpyd_rec, dpyd_poly = dpyd_from_diplotype(dpyd_a1, dpyd_a2)
-            dpyd_vals = {}
-        else:
-            dpyd_vals = {k: request.form.get(k, "-/-") for k in dpyd_inputs.keys()}
-            dpyd_dipl, dpyd_pheno, dpyd_rec, dpyd_poly = dpyd_from_markers(dpyd_vals)
-            dpyd_a1 = dpyd_a2 = ""
-
-        # ----------------------------- UGT1A1 --------------------------------
-        ugt_mode = request.form.get("ugt_mode", "markers")
-        if ugt_mode == "diplotype":
-            ugt_a1 = request.form.get("ugt_a1", "*1")
-            ugt_a2 = request.form.get("ugt_a2", "*1")
-            ugt_dipl, ugt_pheno, ugt_rec, ugt_poly = ugt1a1_from_diplotype(ugt_a1, ugt_a2)
-            ugt_geno = "-/-"
-        else:
-            ugt_col  = next(iter(ugt_inputs.keys()))
-            ugt_geno = request.form.get(ugt_col, "-/-")
-            ugt_dipl, ugt_pheno, ugt_rec, ugt_poly = ugt1a1_from_markers(ugt_geno)
-            ugt_a1 = ugt_a2 = ""
-
-        # ----------------------------- CYP2D6 --------------------------------
-        cyp_mode = request.form.get("cyp_mode", "diplotype")
-        if cyp_mode == "markers":
-            cyp_vals = {m[0]: request.form.get(m[0], "-/-") for m in cyp_inputs}
-            cyp_dipl, cyp_pheno, cyp_rec, cyp_poly = cyp2d6_from_markers(cyp_vals)
-            cyp_a1 = cyp_a2 = ""
-        else:
-            cyp_a1 = request.form.get("cyp_a1", "*1")
-            cyp_a2 = request.form.get("cyp_a2", "*1")
-            cyp_dipl, cyp_pheno, cyp_rec, cyp_poly = cyp2d6_from_stars(cyp_a1, cyp_a2)
-            cyp_vals = {}
+        res = _analyze_form(request.form)
+        dpyd_dipl, dpyd_pheno, dpyd_rec, _ = res["DPYD"]
+        cyp_dipl,  cyp_pheno,  cyp_rec,  _ = res["CYP2D6"]
+        ugt_dipl,  ugt_pheno,  ugt_rec,  _ = res["UGT1A1"]
 
         preview = [
             {"gen": "DPYD",   "dipl": dpyd_dipl, "pheno": dpyd_pheno, "drug": "Fluorouracilo, capecitabina, tegafur", "rec": dpyd_rec},
@@ -489,32 +699,26 @@ def index():
 
         return render_template(
             "preview.html",
-            patient=patient, clinical=clinical, preview=preview,
-
-            # DPYD
-            dpyd_mode=dpyd_mode, dpyd_inputs=dpyd_inputs, dpyd_vals=dpyd_vals,
-            dpyd_a1=dpyd_a1, dpyd_a2=dpyd_a2, dpyd_stars=DPYD_STARS,
-
-            # UGT1A1
-            ugt_mode=ugt_mode, ugt_inputs=ugt_inputs, ugt_geno=ugt_geno,
-            ugt_a1=ugt_a1, ugt_a2=ugt_a2, ugt_stars=UGT1A1_STARS,
-
-            # CYP2D6
-            cyp_mode=cyp_mode, cyp_inputs=cyp_inputs, cyp_vals=cyp_vals,
-            cyp_a1=cyp_a1, cyp_a2=cyp_a2, cyp_stars=CYP_STARS,
+            patient=res["patient"], clinical=res["clinical"], preview=preview,
+            # Selección del formulario (modos, marcadores y alelos)
+            **res["state"],
+            # Opciones de los selectores
+            dpyd_inputs=_DPYD_INPUTS, dpyd_stars=DPYD_STARS,
+            ugt_inputs=_UGT_INPUTS, ugt_stars=UGT1A1_STARS,
+            cyp_inputs=_CYP_INPUTS, cyp_stars=CYP_STARS,
         )
 
     # GET: render del formulario
     return render_template(
         "index.html",
         # DPYD
-        dpyd_inputs={m["column"]: m["options"] for m in MARKERS.get("DPYD", [])},
+        dpyd_inputs=_DPYD_INPUTS,
         dpyd_stars=DPYD_STARS,
         # UGT1A1
-        ugt_inputs={m["column"]: m["options"] for m in MARKERS.get("UGT1A1", [])},
+        ugt_inputs=_UGT_INPUTS,
         ugt_stars=UGT1A1_STARS,
         # CYP2D6
-        cyp_inputs=[(m["column"], m["options"]) for m in MARKERS.get("CYP2D6", [])],
+        cyp_inputs=_CYP_INPUTS,
         cyp_stars=CYP_STARS,
     )
 
@@ -522,76 +726,38 @@ def index():
 def generate():
     """
     Genera informe desde el POST del preview.
-    - Renderiza plantilla DOCX con subdocumento de resultados.
-    - Ajusta la tabla al ancho útil de página (fix overflow).
-    - Intenta convertir a PDF con docx2pdf (Word en Windows). Si falla, entrega DOCX.
+    - Renderiza plantilla DOCX con subdocumento de resultados (ya ajustado al
+      ancho útil de página: fix overflow).
+    - Convierte a PDF (Word vía COM) solo en Windows y sin DISABLE_PDF; si no es
+      posible o falla, entrega DOCX.
+    - Con ?format=docx se entrega directamente el DOCX, sin pasar por Word.
+    - Con ?async=1 la conversión a PDF se encola y se responde 202 (página de
+      espera para el navegador, JSON con el id del trabajo para clientes API);
+      el informe se descarga después desde /report/<job_id>.
     """
-    # --------------------------- Paciente / Clínica ---------------------------
-    patient = {
-        "nombre":     request.form.get("nombre", ""),
-        "apellidos":  request.form.get("apellidos", ""),
-        "full_name":  (request.form.get("nombre", "") + " " + request.form.get("apellidos", "")).strip(),
-        "historia":   request.form.get("historia", ""),
-        "sexo":       request.form.get("sexo", "-"),
-        "fecha_nac":  request.form.get("fecha_nac", "")
-    }
-    clinical = {
-        "enf_actual":  request.form.get("enf_actual", ""),
-        "otras_pat":   request.form.get("otras_pat", ""),
-        "tratamiento": request.form.get("tto", ""),
-    }
-
-    # ------------------------------ DPYD -------------------------------------
-    dpyd_inputs = {m["column"]: m["options"] for m in MARKERS.get("DPYD", [])}
-    dpyd_mode = request.form.get("dpyd_mode", "markers")
-    if dpyd_mode == "diplotype":
-        dpyd_a1 = request.form.get("dpyd_a1", "*1")
-        dpyd_a2 = request.form.get("dpyd_a2", "*1")
-        dpyd_dipl, dpyd_pheno, dpyd_rec, dpyd_poly = dpyd_from_diplotype(dpyd_a1, dpyd_a2)
-    else:
-        dpyd_vals = {k: request.form.get(k, "-/-") for k in dpyd_inputs.keys()}
-        dpyd_dipl, dpyd_pheno, dpyd_rec, dpyd_poly = dpyd_from_markers(dpyd_vals)
-
-    # ------------------------------ UGT1A1 -----------------------------------
-    ugt_inputs = {m["column"]: m["options"] for m in MARKERS.get("UGT1A1", [])}
-    ugt_mode = request.form.get("ugt_mode", "markers")
-    if ugt_mode == "diplotype":
-        ugt_a1 = request.form.get("ugt_a1", "*1")
-        ugt_a2 = request.form.get("ugt_a2", "*1")
-        ugt_dipl, ugt_pheno, ugt_rec, ugt_poly = ugt1a1_from_diplotype(ugt_a1, ugt_a2)
-    else:
-        ugt_col  = next(iter(ugt_inputs.keys()))
-        ugt_geno = request.form.get(ugt_col, "-/-")
-        ugt_dipl, ugt_pheno, ugt_rec, ugt_poly = ugt1a1_from_markers(ugt_geno)
-
-    # ------------------------------ CYP2D6 -----------------------------------
-    cyp_inputs = [(m["column"], m["options"]) for m in MARKERS.get("CYP2D6", [])]
-    cyp_mode = request.form.get("cyp_mode", "diplotype")
-    if cyp_mode == "markers":
-        cyp_vals = {m[0]: request.form.get(m[0], "-/-") for m in cyp_inputs}
-        cyp_dipl, cyp_pheno, cyp_rec, cyp_poly = cyp2d6_from_markers(cyp_vals)
-    else:
-        cyp_a1 = request.form.get("cyp_a1", "*1")
-        cyp_a2 = request.form.get("cyp_a2", "*1")
-        cyp_dipl, cyp_pheno, cyp_rec, cyp_poly = cyp2d6_from_stars(cyp_a1, cyp_a2)
+    want_pdf = request.args.get("format", "pdf") != "docx"
+    res = _analyze_form(request.form)
+    patient, clinical = res["patient"], res["clinical"]
+    dpyd_dipl, dpyd_pheno, dpyd_rec, dpyd_poly = res["DPYD"]
+    cyp_dipl,  cyp_pheno,  cyp_rec,  cyp_poly  = res["CYP2D6"]
+    ugt_dipl,  ugt_pheno,  ugt_rec,  ugt_poly  = res["UGT1A1"]
 
     # --------------------------- Contexto informe ----------------------------
     summary = [
-        {"gen": "DPYD",   "diplotipo": dpyd_dipl, "fenotipo": dpyd_pheno, "drug": "Fluorouracilo, capecitabina, tegafur", "rec": dpyd_rec},
-        {"gen": "CYP2D6", "diplotipo": cyp_dipl,  "fenotipo": cyp_pheno,  "drug": "Tamoxifeno",                            "rec": cyp_rec},
-        {"gen": "UGT1A1", "diplotipo": ugt_dipl,  "fenotipo": ugt_pheno,  "drug": "Irinotecán",                            "rec": ugt_rec},
+        {"gen": "DPYD",   "dipl": dpyd_dipl, "pheno": dpyd_pheno, "drug": "Fluorouracilo, capecitabina, tegafur", "rec": dpyd_rec},
+        {"gen": "CYP2D6", "dipl": cyp_dipl,  "pheno": cyp_pheno,  "drug": "Tamoxifeno",                            "rec": cyp_rec},
+        {"gen": "UGT1A1", "dipl": ugt_dipl,  "pheno": ugt_pheno,  "drug": "Irinotecán",                            "rec": ugt_rec},
     ]
 
-    tpl_path = TPL_DATA_PATH if os.path.exists(TPL_DATA_PATH) else TPL_APP_PATH
-    tpl = DocxTemplate(tpl_path)
-    tabla_subdoc = build_result_subdoc(tpl, summary)
+    tpl = _new_template()
+    tabla_subdoc = build_result_subdoc(summary)
 
     now = datetime.datetime.now()
     context = {
         "patient": patient,
         "clinical": clinical,
         "TABLA_RESULTADO": tabla_subdoc,
-        "polymorphisms": "; ".join(dpyd_poly + cyp_poly + ugt_poly),
+        "polymorphisms": "; ".join((*dpyd_poly, *cyp_poly, *ugt_poly)),
         "sources": {"cpic_url": "https://cpicpgx.org/guidelines/", "dpwgd_doi": "DOI:10.1038/s41431-022-01243-2"},
         "meta": {
             "sample_code": patient.get("historia") or "—",
@@ -603,41 +769,156 @@ def generate():
         },
     }
 
-    # ------------------------- Render + ajuste tabla -------------------------
-    # 1) Renderizamos a un DOCX temporal
-    tmp_docx = os.path.join(tempfile.gettempdir(), f"GenoPilot_tmp_{now.strftime('%H%M%S')}.docx")
-    tpl.render(context)
-    tpl.save(tmp_docx)
-
-    # 2) Reabrimos y AJUSTAMOS la tabla al ancho útil de página (evita desborde)
-    try:
-        doc = Document(tmp_docx)
-        fit_results_table(doc)   # <-- fix overflow
-        doc.save(tmp_docx)
-    except Exception:
-        # Si por algún motivo python-docx falla, seguimos con el DOCX renderizado
-        pass
+    # ------------------------------- Render ----------------------------------
+    # La tabla ya sale ajustada al ancho útil: se serializa una vez, en memoria
+    tpl.render(context, jinja_env=_JINJA_ENV)
+    buf = BytesIO()
+    tpl.save(buf)
 
     # --------------------------- Exportación final ---------------------------
-    pdf_name = f"GenoPilot_{patient.get('full_name','Paciente')}_{now.strftime('%Y%m%d_%H%M')}.pdf"
+    # Nombre saneado (igual que en lotes): es ruta en reports/ y cabecera ASCII
+    safe_name = secure_filename(patient["full_name"]) or "Paciente"
+    pdf_name = f"GenoPilot_{safe_name}_{now.strftime('%Y%m%d_%H%M')}.pdf"
     pdf_path = os.path.join(REPORTS_DIR, pdf_name)
 
-    try:
-        from docx2pdf import convert
-        convert(tmp_docx, pdf_path)   # Requiere MS Word (Windows)
-        return send_file(pdf_path, as_attachment=True, download_name=pdf_name, mimetype="application/pdf")
-    except Exception:
-        pass  # Fallback a DOCX más abajo
+    if want_pdf and _convert is not None and request.args.get("async") == "1":
+        job_id = _submit_pdf_job(buf.getvalue(), pdf_name)
+        poll = url_for("main.report", job_id=job_id)
+        # Navegador (formulario): página que sondea y descarga; API: JSON
+        if request.accept_mimetypes.best_match(["application/json", "text/html"]) == "text/html":
+            return render_template("report_wait.html", poll=poll), 202
+        return {"job_id": job_id, "poll": poll}, 202
+
+    if want_pdf and _convert is not None:
+        # docx2pdf necesita una ruta real: solo aquí se escribe el DOCX a disco
+        # (nombre único: peticiones concurrentes no comparten temporal)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as f:
+            f.write(buf.getbuffer())
+        try:
+            _convert(f.name, pdf_path)   # Requiere MS Word (Windows)
+            return send_file(pdf_path, as_attachment=True, download_name=pdf_name,
+                             mimetype="application/pdf", max_age=0)
+        except Exception:
+            pass  # Fallback a DOCX más abajo
+        finally:
+            with suppress(OSError):
+                os.remove(f.name)
 
-    # Fallback: entregar DOCX
+    # Fallback: entregar DOCX desde memoria
+    buf.seek(0)
     return send_file(
-        tmp_docx,
+        buf,
         as_attachment=True,
         download_name=pdf_name.replace(".pdf", ".docx"),
-        mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        mimetype=_DOCX_MIMETYPE,
+        max_age=0,
     )
 
 
+# ============================================================================
+# Conversión a PDF en segundo plano (/generate?async=1 → /report/<job_id>)
+# El worker HTTP queda libre mientras Word convierte. Cada trabajo vive en
+# reports/jobs/<job_id>/: el estado se lee del disco, así que cualquier worker
+# de gunicorn puede servir el resultado.
+# ============================================================================
+_JOBS_DIR   = os.path.join(REPORTS_DIR, "jobs")
+_JOB_TTL_S  = int(os.getenv("REPORT_JOB_TTL_S", "3600"))   # informes con datos de paciente
+_JOB_ERROR  = ".error"     # marca terminal: no se pudo dejar ni PDF ni DOCX
+_RE_JOB_ID  = re.compile(r"[0-9a-f]{32}")
+_JOB_POOL   = ThreadPoolExecutor(max_workers=max(1, int(os.getenv("PDF_WORKERS", "1"))),
+                                 thread_name_prefix="report-job")
+
+def _pdf_job(docx_bytes: bytes, job_dir: str, pdf_name: str):
+    """
+    Convierte el DOCX a PDF dentro de job_dir; si falla, deja el DOCX (mismo
+    fallback que /generate) y, si ni eso es posible, la marca _JOB_ERROR: el
+    trabajo siempre termina en un estado que /report puede responder.
+    Los ficheros a medias llevan prefijo '.' y el final aparece con os.replace:
+    /report nunca sirve uno incompleto. Mientras se convierte, el DOCX fuente
+    ('.<nombre>.docx', ya completo) se puede descargar con ?format=docx.
+    """
+    docx_name = pdf_name.replace(".pdf", ".docx")
+    src  = os.path.join(job_dir, "." + docx_name)
+    part = os.path.join(job_dir, ".pending.pdf")
+    raw  = os.path.join(job_dir, ".pending.docx")
+    try:
+        Path(raw).write_bytes(docx_bytes)
+        os.replace(raw, src)
+        try:
+            _convert(src, part)
+            os.replace(part, os.path.join(job_dir, pdf_name))
+            return
+        except Exception:
+            pass
+        os.replace(src, os.path.join(job_dir, docx_name))
+    except Exception:
+        with suppress(OSError):
+            Path(job_dir, _JOB_ERROR).touch()
+    finally:
+        for tmp in (src, part, raw):
+            with suppress(OSError):
+                os.remove(tmp)
+
+def _purge_old_jobs():
+    """Borra los trabajos con más de _JOB_TTL_S segundos (informes ya servidos o abandonados)."""
+    cutoff = datetime.datetime.now().timestamp() - _JOB_TTL_S
+    with suppress(FileNotFoundError), os.scandir(_JOBS_DIR) as it:
+        for entry in it:
+            with suppress(OSError):
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+def _submit_pdf_job(docx_bytes: bytes, pdf_name: str) -> str:
+    """Encola la conversión y devuelve el id del trabajo (purga antes los caducados)."""
+    _purge_old_jobs()
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(_JOBS_DIR, job_id)
+    os.makedirs(job_dir)
+    _JOB_POOL.submit(_pdf_job, docx_bytes, job_dir, pdf_name)
+    return job_id
+
+@bp.route("/report/<job_id>")
+def report(job_id: str):
+    """
+    Descarga el informe de un trabajo encolado; 202 mientras se convierte y 500
+    si el trabajo terminó sin informe. 404 para ids desconocidos o ya purgados.
+    ?format=docx: el DOCX sin esperar al PDF (la página de espera lo ofrece si
+    la conversión tarda demasiado).
+    """
+    if not _RE_JOB_ID.fullmatch(job_id):
+        abort(404)
+    job_dir = os.path.join(_JOBS_DIR, job_id)
+    want_docx = request.args.get("format") == "docx"
+    # El fichero se abre antes de responder: el DOCX fuente puede desaparecer
+    # entre el listado y el envío (el PDF acaba de terminar); entonces se
+    # vuelve a listar y se sirve el informe final
+    for _ in range(2):
+        try:
+            names = os.listdir(job_dir)
+        except FileNotFoundError:
+            abort(404)
+        done = [n for n in names if not n.startswith(".")]
+        if want_docx:
+            # El DOCX fuente solo existe mientras se convierte; si ya hay PDF, se sirve ese
+            done = [n for n in names if n.endswith(".docx") and n != ".pending.docx"] or done
+        if not done:
+            break
+        try:
+            fh = open(os.path.join(job_dir, done[0]), "rb")
+        except FileNotFoundError:
+            continue
+        name = done[0].lstrip(".")
+        return send_file(
+            fh,
+            as_attachment=True,
+            download_name=name,
+            mimetype="application/pdf" if name.endswith(".pdf") else _DOCX_MIMETYPE,
+        )
+    if _JOB_ERROR in names:
+        return {"status": "error"}, 500
+    return {"status": "pending"}, 202
+
+
 # app/routes.py  (utilidad para extraer % de dosis)  # === NEW ===
 def extract_dose_pct(gene: str, pheno: str, rec_text: str | None) -> str:
     """
@@ -662,11 +943,11 @@ def extract_dose_pct(gene: str, pheno: str, rec_text: str | None) -> str:
 
     # Extracción de porcentajes del texto (si hay)
     t = (rec_text or "")
-    m_range = re.search(r'(\d{1,3})\s*[–-]\s*(\d{1,3})\s*%', t)
+    m_range = _RE_PCT_RANGE.search(t)
     if m_range:
         a, b = m_range.groups()
         return f"{a}–{b}%"
-    m_single = re.search(r'[≈~]?\s*(\d{1,3})\s*%', t)
+    m_single = _RE_PCT.search(t)
     if m_single:
         return f"{m_single.group(1)}%"
 
@@ -694,9 +975,7 @@ def _save_batch(rows: list[dict]) -> str:
     return token
 
 def _load_batch(token: str) -> list[dict]:
-    path = os.path.join(tempfile.gettempdir(), token)
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return _json_loads(Path(tempfile.gettempdir(), token).read_bytes())
 
 # app/routes.py  (parser del Excel)  # === NEW ===
 def parse_lab_excel(file_storage) -> tuple[str, int]:
@@ -709,19 +988,14 @@ def parse_lab_excel(file_storage) -> tuple[str, int]:
     if ext not in ALLOWED_EXTS:
         raise ValueError("Formato no soportado. Sube .xlsx, .xls o .csv")
 
+    import pandas as pd
     if ext == "csv":
         df = pd.read_csv(file_storage, dtype=str, keep_default_na=False)
     else:
         df = pd.read_excel(file_storage, dtype=str, keep_default_na=False)
 
-    # Columnas esperadas
-    need_cols = ["Sample/Assay"]
-    for g in ("CYP2D6", "DPYD", "UGT1A1"):
-        for m in MARKERS.get(g, []):
-            need_cols.append(m["column"])
-
-    # Subconjunto de columnas existentes (no fallar si falta alguna)
-    cols = [c for c in df.columns if c in need_cols]
+    # Subconjunto de columnas esperadas existentes (no fallar si falta alguna)
+    cols = [c for c in df.columns if c in _LAB_COLS]
     if "Sample/Assay" not in cols:
         raise ValueError("Falta la columna 'Sample/Assay'")
 
@@ -729,12 +1003,8 @@ def parse_lab_excel(file_storage) -> tuple[str, int]:
     for _, r in df.iterrows():
         row = {"sample": str(r.get("Sample/Assay", "")).strip()}
         # Guardamos solo lo necesario por gen:
-        for m in MARKERS.get("CYP2D6", []):
-            row[m["column"]] = _norm_excel_val(r.get(m["column"]))
-        for m in MARKERS.get("DPYD", []):
-            row[m["column"]] = _norm_excel_val(r.get(m["column"]))
-        for m in MARKERS.get("UGT1A1", []):
-            row[m["column"]] = _norm_excel_val(r.get(m["column"]))
+        for col in _LAB_MARKER_COLS:
+            row[col] = _norm_excel_val(r.get(col))
 
         # descarta filas totalmente vacías
         if row["sample"] or any(v and v != "-/-" for k, v in row.items() if k != "sample"):
@@ -784,9 +1054,9 @@ def batch_patient(idx: int):
     row = rows[idx]
 
     # Construimos dicts como los de tu formulario manual
-    dpyd_vals = {m["column"]: row.get(m["column"], "-/-") for m in MARKERS.get("DPYD", [])}
-    ugt_vals  = {m["column"]: row.get(m["column"], "-/-") for m in MARKERS.get("UGT1A1", [])}
-    cyp_vals  = {m["column"]: row.get(m["column"], "-/-") for m in MARKERS.get("CYP2D6", [])}
+    dpyd_vals = {c: row.get(c, "-/-") for c in _DPYD_INPUTS}
+    ugt_vals  = {c: row.get(c, "-/-") for c in _UGT_INPUTS}
+    cyp_vals  = {c: row.get(c, "-/-") for c, _ in _CYP_INPUTS}
 
     # Cálculos (reutilizamos tus funciones)
     dpyd_dipl, dpyd_pheno, dpyd_rec, dpyd_polym = dpyd_from_markers(dpyd_vals)
@@ -799,23 +1069,24 @@ def batch_patient(idx: int):
     cyp_dose  = extract_dose_pct("CYP2D6", cyp_pheno,  cyp_rec)
 
     if request.method == "POST":
+        fg = request.form.get
         # Datos del paciente
         patient = {
-            "nombre":     request.form.get("nombre", ""),
-            "apellidos":  request.form.get("apellidos", ""),
-            "full_name":  (request.form.get("nombre", "") + " " + request.form.get("apellidos", "")).strip(),
-            "historia":   request.form.get("historia", ""),
-            "sexo":       request.form.get("sexo", "-"),
-            "fecha_nac":  request.form.get("fecha_nac", "")
+            "nombre":     fg("nombre", ""),
+            "apellidos":  fg("apellidos", ""),
+            "full_name":  (fg("nombre", "") + " " + fg("apellidos", "")).strip(),
+            "historia":   fg("historia", ""),
+            "sexo":       fg("sexo", "-"),
+            "fecha_nac":  fg("fecha_nac", "")
         }
         clinical = {
-            "enf_actual":  request.form.get("enf_actual", ""),
-            "otras_pat":   request.form.get("otras_pat", ""),
-            "tratamiento": request.form.get("tto", ""),
+            "enf_actual":  fg("enf_actual", ""),
+            "otras_pat":   fg("otras_pat", ""),
+            "tratamiento": fg("tto", ""),
         }
 
         # Render directo (como en /generate)
-        tpl = DocxTemplate(TPL_DATA_PATH)
+        tpl = _new_template()
         now = datetime.datetime.now()
         results = [
             {"gen": "DPYD",   "dipl": dpyd_dipl, "pheno": dpyd_pheno, "drug": "5-FU/Capecitabina", "rec": dpyd_rec, "dose": dpyd_dose},
@@ -829,37 +1100,34 @@ def batch_patient(idx: int):
             "dpyd": {"dipl": dpyd_dipl, "pheno": dpyd_pheno, "polym": "\n".join(dpyd_polym)},
             "cyp2d6": {"dipl": cyp_dipl, "pheno": cyp_pheno, "polym": "\n".join(cyp_polym)},
             "ugt1a1": {"dipl": ugt_dipl, "pheno": ugt_pheno, "polym": "\n".join(ugt_polym)},
-            "results_subdoc": build_result_subdoc(tpl, results),
+            "results_subdoc": build_result_subdoc(results),
             "meta": {"sample": row.get("sample", ""), "version": "0.6.0"},
         }
 
-        tmp_docx = os.path.join(tempfile.gettempdir(), f"GenoPilot_tmp_{now.strftime('%H%M%S')}.docx")
-        tpl.render(context)
-        tpl.save(tmp_docx)
-
-        try:
-            doc = Document(tmp_docx)
-            fit_results_table(doc)
-            doc.save(tmp_docx)
-        except Exception:
-            pass
+        tpl.render(context, jinja_env=_JINJA_ENV)
 
         os.makedirs(REPORTS_DIR, exist_ok=True)
-        safe_name = re.sub(r"[^A-Za-z0-9 _.-]", "", patient["full_name"] or row.get("sample", "") or "Paciente")
+        safe_name = secure_filename(patient["full_name"] or row.get("sample", "")) or "Paciente"
         pdf_name  = f"GenoPilot_{safe_name}_{now.strftime('%Y%m%d_%H%M')}.pdf"
         pdf_path  = os.path.join(REPORTS_DIR, pdf_name)
+        docx_path = os.path.join(REPORTS_DIR, pdf_name.replace(".pdf", ".docx"))
+
+        if _convert is None:
+            # Sin conversión: el DOCX se guarda directamente en reports/
+            tpl.save(docx_path)
+            return redirect(url_for("main.batch_patient", idx=idx+1, token=token))
 
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as f:
+            tpl.save(f)
         try:
-            if not DISABLE_PDF and IS_WINDOWS:
-                from docx2pdf import convert
-                convert(tmp_docx, pdf_path)
-                return redirect(url_for("main.batch_patient", idx=idx+1, token=token))
+            _convert(f.name, pdf_path)
+            os.remove(f.name)
+            return redirect(url_for("main.batch_patient", idx=idx+1, token=token))
         except Exception:
             pass
 
         # Fallback: dejar el DOCX guardado (mismo nombre cambiando extensión)
-        docx_name = pdf_name.replace(".pdf", ".docx")
-        os.replace(tmp_docx, os.path.join(REPORTS_DIR, docx_name))
+        os.replace(f.name, docx_path)
         return redirect(url_for("main.batch_patient", idx=idx+1, token=token))
 
     # GET: pintar pantalla paciente de la fila idx
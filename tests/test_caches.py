@@ -0,0 +1,58 @@
+"""
+GenoPilot – Pruebas de las cachés: solo se memoizan valores de los selectores
+del formulario; cualquier otro texto se calcula sin quedar retenido.
+"""
+import os, unittest
+
+os.environ.setdefault("DISABLE_PDF", "1")
+
+from app import create_app, routes
+from tests.test_generate import full_form
+
+
+class DiplotypeCacheTest(unittest.TestCase):
+    ANALYZERS = (routes.dpyd_from_diplotype, routes.ugt1a1_from_diplotype,
+                 routes.cyp2d6_from_stars)
+
+    def setUp(self):
+        for fn in self.ANALYZERS + (routes._cyp_lookup_pheno,):
+            fn.cache_clear()
+
+    def test_known_alleles_are_cached(self):
+        for fn in self.ANALYZERS:
+            first = fn("*1", "*1")
+            self.assertIs(fn("*1", "*1"), first)
+            self.assertEqual(fn.cache_info().currsize, 1)
+
+    def test_unknown_alleles_are_not_cached(self):
+        junk = "*" + "x" * 10_000
+        for fn in self.ANALYZERS:
+            self.assertIn(junk, fn("*1", junk)[0])
+            self.assertEqual(fn.cache_info().currsize, 0)
+        self.assertEqual(routes._cyp_lookup_pheno.cache_info().currsize, 0)
+
+
+class AnalyzeGenesCacheTest(unittest.TestCase):
+    def setUp(self):
+        routes._analyze_genes.cache_clear()
+        self.client = create_app().test_client()
+
+    def preview(self, **overrides):
+        resp = self.client.post("/", data=full_form(**overrides))
+        self.assertEqual(resp.status_code, 200)
+        return routes._analyze_genes.cache_info().currsize
+
+    def test_form_options_are_cached(self):
+        self.assertEqual(self.preview(), 1)
+        self.assertEqual(self.preview(), 1)
+        self.assertEqual(routes._analyze_genes.cache_info().hits, 1)
+
+    def test_free_text_is_not_cached(self):
+        col = next(iter(routes._DPYD_INPUTS))
+        self.assertEqual(self.preview(**{col: "x" * 10_000}), 0)
+        self.assertEqual(self.preview(cyp_a1="*" + "x" * 10_000), 0)
+        self.assertEqual(self.preview(cyp_mode="otro"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
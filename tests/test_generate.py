@@ -0,0 +1,83 @@
+"""
+GenoPilot – Pruebas de '/generate' con el cliente de test de Flask.
+Sin conversión a PDF (DISABLE_PDF=1): la ruta entrega el DOCX desde memoria.
+"""
+import io, os, unittest, zipfile
+from unittest import mock
+
+os.environ.setdefault("DISABLE_PDF", "1")
+
+from app import create_app
+from app import routes
+
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def full_form(**overrides) -> dict:
+    """Formulario completo tal como lo envía el preview (marcadores en DPYD/UGT1A1)."""
+    form = {
+        "nombre": "Ana", "apellidos": "Pérez", "historia": "HC-001", "sexo": "F",
+        "fecha_nac": "01/01/1970", "enf_actual": "Cáncer colorrectal",
+        "otras_pat": "", "tto": "Capecitabina",
+        "dpyd_mode": "markers", "ugt_mode": "markers", "cyp_mode": "diplotype",
+        "cyp_a1": "*1", "cyp_a2": "*4",
+    }
+    form.update({col: opts[0] for col, opts in routes._DPYD_INPUTS.items()})
+    form.update({col: opts[0] for col, opts in routes._UGT_INPUTS.items()})
+    form.update(overrides)
+    return form
+
+
+class GenerateTest(unittest.TestCase):
+    def setUp(self):
+        self.client = create_app().test_client()
+
+    def assertDocx(self, resp):
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, DOCX_MIMETYPE)
+        with zipfile.ZipFile(io.BytesIO(resp.data)) as z:
+            xml = z.read("word/document.xml").decode("utf-8")
+        self.assertIn("<w:tbl>", xml)
+        self.assertIn("Tamoxifeno", xml)
+        return xml
+
+    def test_generate_returns_docx(self):
+        resp = self.client.post("/generate", data=full_form())
+        self.assertDocx(resp)
+
+    def test_generate_diplotype_modes(self):
+        form = full_form(dpyd_mode="diplotype", dpyd_a1="*1", dpyd_a2="*2A",
+                         ugt_mode="diplotype", ugt_a1="*1", ugt_a2="*28")
+        self.assertDocx(self.client.post("/generate", data=form))
+
+    def test_format_docx_skips_conversion(self):
+        # Aunque haya conversor, ?format=docx no debe llegar a invocarlo
+        def no_convert(src, dst):
+            raise AssertionError("format=docx no debe convertir a PDF")
+        with mock.patch.object(routes, "_convert", no_convert):
+            resp = self.client.post("/generate?format=docx", data=full_form())
+        self.assertDocx(resp)
+        # Nombre de descarga saneado con secure_filename (sin espacios ni acentos)
+        self.assertRegex(resp.headers["Content-Disposition"],
+                         r"^attachment; filename=GenoPilot_Ana_Perez_\d{8}_\d{4}\.docx$")
+
+    def test_template_without_table_grid(self):
+        # Plantilla sin el estilo 'Table Grid': la tabla lleva sus propios bordes
+        from docx import Document
+        doc = Document(io.BytesIO(routes._TPL_BYTES))
+        style = doc.styles["Table Grid"].element
+        style.getparent().remove(style)
+        buf = io.BytesIO()
+        doc.save(buf)
+        routes._result_table_layout.cache_clear()
+        self.addCleanup(routes._result_table_layout.cache_clear)
+        with mock.patch.object(routes, "_TPL_BYTES", buf.getvalue()):
+            self.assertDocx(self.client.post("/generate", data=full_form()))
+            head_xml = routes._result_table_layout()[1]
+        self.assertIn("<w:tblBorders>", head_xml)
+        self.assertNotIn("<w:tblStyle ", head_xml)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
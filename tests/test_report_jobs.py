@@ -0,0 +1,127 @@
+"""
+GenoPilot – Pruebas de la conversión en segundo plano (/generate?async=1 →
+/report/<job_id>) con un conversor simulado.
+"""
+import os, shutil, tempfile, threading, time, unittest
+from unittest import mock
+
+os.environ.setdefault("DISABLE_PDF", "1")
+
+from app import create_app
+from app import routes
+from tests.test_generate import full_form
+
+
+def copy_convert(src, dst):
+    shutil.copy(src, dst)
+
+def failing_convert(src, dst):
+    raise RuntimeError("Word no disponible")
+
+
+class ReportJobTest(unittest.TestCase):
+    def setUp(self):
+        self.jobs_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.jobs_dir, ignore_errors=True)
+        patcher = mock.patch.object(routes, "_JOBS_DIR", self.jobs_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = create_app().test_client()
+
+    def submit(self):
+        resp = self.client.post("/generate?async=1", data=full_form(),
+                                headers={"Accept": "application/json"})
+        self.assertEqual(resp.status_code, 202)
+        return resp.json["poll"]
+
+    def wait(self, url, timeout=5.0):
+        """Sondea url hasta que deja de dar 202 (o vence el plazo)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            resp = self.client.get(url)
+            resp.close()
+            if resp.status_code != 202 or time.monotonic() > deadline:
+                return resp
+            time.sleep(0.05)
+
+    def run_job(self, convert):
+        """Lanza un informe asíncrono y espera a que /report deje de dar 202."""
+        with mock.patch.object(routes, "_convert", convert):
+            return self.wait(self.submit())
+
+    def submit_and_finish(self):
+        """Lanza un informe asíncrono con conversión correcta; devuelve su url de sondeo."""
+        with mock.patch.object(routes, "_convert", copy_convert):
+            poll = self.submit()
+            self.assertEqual(self.wait(poll).status_code, 200)
+        return poll
+
+    def test_pdf_ready(self):
+        resp = self.run_job(copy_convert)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "application/pdf")
+
+    def test_conversion_failure_falls_back_to_docx(self):
+        resp = self.run_job(failing_convert)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, routes._DOCX_MIMETYPE)
+
+    def test_write_failure_is_terminal(self):
+        with mock.patch.object(routes.Path, "write_bytes", side_effect=OSError("disco lleno")):
+            resp = self.run_job(copy_convert)
+        self.assertEqual(resp.status_code, 500)
+        self.assertEqual(resp.json, {"status": "error"})
+
+    def test_docx_available_while_converting(self):
+        release = threading.Event()
+        def slow_convert(src, dst):
+            release.wait(5)
+            shutil.copy(src, dst)
+        with mock.patch.object(routes, "_convert", slow_convert):
+            poll = self.submit()
+            try:
+                self.assertEqual(self.client.head(poll).status_code, 202)
+                resp = self.wait(poll + "?format=docx")
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.mimetype, routes._DOCX_MIMETYPE)
+                self.assertRegex(resp.headers["Content-Disposition"],
+                                 r"filename=GenoPilot_Ana_Perez_\d{8}_\d{4}\.docx$")
+            finally:
+                release.set()
+            self.assertEqual(self.wait(poll).mimetype, "application/pdf")
+        # Ya convertido, ?format=docx sirve el PDF en lugar de quedarse en 202
+        self.assertEqual(self.wait(poll + "?format=docx").mimetype, "application/pdf")
+
+    def test_docx_link_survives_source_removal(self):
+        # Carrera: el listado aún ve el DOCX fuente, pero el PDF acaba de
+        # terminar y _pdf_job lo borra antes de abrirlo
+        poll = self.submit_and_finish()
+        job_dir = os.path.join(self.jobs_dir, poll.rsplit("/", 1)[1])
+        real_listdir = os.listdir
+        calls = []
+        def stale_listdir(path):
+            calls.append(path)
+            names = real_listdir(path)
+            return names + [".GenoPilot_gone.docx"] if len(calls) == 1 else names
+        with mock.patch.object(routes.os, "listdir", stale_listdir):
+            resp = self.client.get(poll + "?format=docx")
+        resp.close()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "application/pdf")
+        self.assertEqual(calls, [job_dir, job_dir])
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get("/report/zz").status_code, 404)
+        self.assertEqual(self.client.get("/report/" + "a" * 32).status_code, 404)
+
+    def test_expired_jobs_are_purged_on_submit(self):
+        old = os.path.join(self.jobs_dir, "f" * 32)
+        os.makedirs(old)
+        past = time.time() - routes._JOB_TTL_S - 60
+        os.utime(old, (past, past))
+        self.run_job(copy_convert)
+        self.assertFalse(os.path.exists(old))
+
+
+if __name__ == "__main__":
+    unittest.main()
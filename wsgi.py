@@ -5,13 +5,8 @@ WSGI entrypoint for production (Gunicorn).
 """
 import os
 
-try:
-    # Preferred: application factory
-    from app import create_app  # ajusta si tu módulo/fábrica tiene otro nombre
-    app = create_app()
-except ImportError:
-    # Fallback: app global (por si tu proyecto no usa fábrica)
-    from app import app  # type: ignore
+from app import create_app
+app = create_app()
 
 if __name__ == "__main__":
     # Permite ejecutar localmente: `python wsgi.py`